@@ -1,4 +1,55 @@
-import requests, time
+import requests, time, os
+from math import radians, cos, isfinite
+from gpx import haversine, METERS_PER_DEGREE
+
+class ElevationJournal:
+    """Append-only record of the elevations retrieved so far, keyed by API location string.
+
+    Every successful chunk is flushed to disk, so that an interrupted run can be resumed
+    without querying again the points that already succeeded."""
+
+    def _load(self):
+        self._entries = {}
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r') as reader:
+            for line in reader:
+                fields = line.split()
+                # a truncated last line is just ignored
+                if len(fields) != 2:
+                    continue
+                try:
+                    self._entries[fields[0]] = float(fields[1])
+                except ValueError:
+                    continue
+
+    def restore(self, trackpts):
+        restored = 0
+        for trackpt in trackpts:
+            if trackpt.elevation is None:
+                elevation = self._entries.get(trackpt.apiformat())
+                if elevation is not None:
+                    trackpt.elevation = elevation
+                    restored += 1
+        return restored
+
+    def record(self, chunk):
+        with open(self.path, 'a') as writer:
+            for trackpt in chunk:
+                if trackpt.elevation is not None:
+                    self._entries[trackpt.apiformat()] = trackpt.elevation
+                    writer.write('%s %0.2f\n' % (trackpt.apiformat(), trackpt.elevation))
+            writer.flush()
+            os.fsync(writer.fileno())
+
+    def discard(self):
+        self._entries = {}
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def __init__(self, path):
+        self.path = path
+        self._load()
 
 class GoogleElevationAPI(requests.Session):
     CHUNK_SIZE = 56
@@ -15,7 +66,11 @@ class GoogleElevationAPI(requests.Session):
             for i in range(0, len(json['results'])):
                 self._chunk[i].elevation = json['results'][i]['elevation']
 
-    def run(self, trackpts, auto_sleep_quota=True):
+    def run(self, trackpts, auto_sleep_quota=True, journal=None):
+        if journal is not None:
+            restored = journal.restore(trackpts)
+            if restored > 0:
+                print('Restored %d elevations from %s.' % (restored, journal.path))
         slept = False
         idx = 0
         padding_d = '{:>' + str(len(str(len(trackpts)))) + 'd}'
@@ -65,8 +120,129 @@ class GoogleElevationAPI(requests.Session):
                     return False
             else:
                 slept = False
+                if journal is not None:
+                    journal.record(self._chunk)
         return True
 
+    @staticmethod
+    def _cumulative_distance(coords):
+        dist = [0.] * len(coords)
+        for i in range(1, len(coords)):
+            dist[i] = dist[i - 1] + haversine(coords[i - 1][0], coords[i - 1][1], coords[i][0], coords[i][1])
+        return dist
+
+    @staticmethod
+    def _simplify(coords, tolerance):
+        # Douglas-Peucker on an equirectangular projection, in meters
+        if len(coords) < 3:
+            return set(range(len(coords)))
+        scale_lat = METERS_PER_DEGREE
+        scale_lon = scale_lat * cos(radians(coords[0][0]))
+        xy = [(lon * scale_lon, lat * scale_lat) for lat, lon in coords]
+        keep = set([0, len(xy) - 1])
+        stack = [(0, len(xy) - 1)]
+        while len(stack) > 0:
+            first, last = stack.pop()
+            x0, y0 = xy[first]
+            dx, dy = xy[last][0] - x0, xy[last][1] - y0
+            norm2 = dx * dx + dy * dy
+            max_dist2, max_idx = 0., None
+            for i in range(first + 1, last):
+                px, py = xy[i][0] - x0, xy[i][1] - y0
+                if norm2 > 0.:
+                    t = min(1., max(0., (px * dx + py * dy) / norm2))
+                    px, py = px - t * dx, py - t * dy
+                dist2 = px * px + py * py
+                if dist2 > max_dist2:
+                    max_dist2, max_idx = dist2, i
+            if max_idx is not None and max_dist2 > tolerance * tolerance:
+                keep.add(max_idx)
+                stack.append((first, max_idx))
+                stack.append((max_idx, last))
+        return keep
+
+    @staticmethod
+    def _sample(dist, elevations, spacing, tolerance, coords):
+        samples = set()
+        simplified = set() if tolerance is None else GoogleElevationAPI._simplify(coords, tolerance)
+        # distance of the last point with a known or to be queried elevation
+        last_dist = None
+        for i in range(0, len(elevations)):
+            if elevations[i] is not None:
+                last_dist = dist[i]
+                continue
+            # sample whenever the next point would be too far from the last known elevation;
+            # the ends of the track are always sampled rather than extrapolated
+            if last_dist is None or i + 1 == len(elevations) or dist[i + 1] - last_dist > spacing \
+                or i in simplified:
+                samples.add(i)
+                last_dist = dist[i]
+        return samples
+
+    @staticmethod
+    def _interpolate(trackpts, dist, elevations, pending=None):
+        # fills every stretch without elevation, unless it still contains a pending sample
+        i = 0
+        while i < len(elevations):
+            if elevations[i] is not None:
+                i += 1
+                continue
+            start_idx = i
+            while i < len(elevations) and elevations[i] is None:
+                i += 1
+            prev_idx = start_idx - 1 if start_idx > 0 else None
+            next_idx = i if i < len(elevations) else None
+            if prev_idx is None and next_idx is None:
+                return
+            if pending is not None and (prev_idx is None or next_idx is None
+                                        or any(j in pending for j in range(start_idx, i))):
+                continue
+            for j in range(start_idx, i):
+                if prev_idx is None:
+                    elevation = elevations[next_idx]
+                elif next_idx is None or dist[next_idx] == dist[prev_idx]:
+                    elevation = elevations[prev_idx]
+                else:
+                    alpha = (dist[j] - dist[prev_idx]) / (dist[next_idx] - dist[prev_idx])
+                    elevation = (1. - alpha) * elevations[prev_idx] + alpha * elevations[next_idx]
+                trackpts[j].elevation = elevation
+
+    def run_sampled(self, trackpts, spacing, tolerance=None, auto_sleep_quota=True, journal=None):
+        """Queries only a subset of the points lacking elevation and interpolates the rest.
+
+        Points are sampled so that no point is more than `spacing` meters along the track
+        from a known elevation on either side; with `tolerance`, the points where the
+        horizontal path deviates more than `tolerance` meters from its Douglas-Peucker
+        simplification are sampled too. The remaining points are interpolated linearly on
+        the cumulative distance, so the error on each of them is at most half the gap
+        between samples times the steepest grade in between (e.g. 2.5m for 50m spacing on
+        a 10% grade), unless a single step of the track is longer than `spacing`.
+        If some queries fail, only the stretches whose samples were all retrieved are
+        interpolated."""
+        if spacing is None or not isfinite(spacing) or spacing <= 0.:
+            raise ValueError('Invalid sample spacing: %s' % spacing)
+        if tolerance is not None and (not isfinite(tolerance) or tolerance <= 0.):
+            raise ValueError('Invalid simplification tolerance: %s' % tolerance)
+        if journal is not None:
+            restored = journal.restore(trackpts)
+            if restored > 0:
+                print('Restored %d elevations from %s.' % (restored, journal.path))
+        coords = [(trackpt.lat, trackpt.lon) for trackpt in trackpts]
+        elevations = [trackpt.elevation for trackpt in trackpts]
+        dist = self._cumulative_distance(coords)
+        samples = sorted(self._sample(dist, elevations, spacing, tolerance, coords))
+        missing = sum(1 for elevation in elevations if elevation is None)
+        if missing > 0:
+            print('Sampling %d of %d points without elevation.' % (len(samples), missing))
+        success = self.run([trackpts[i] for i in samples], auto_sleep_quota, journal)
+        for i in samples:
+            elevations[i] = trackpts[i].elevation
+        if success:
+            self._interpolate(trackpts, dist, elevations)
+        else:
+            self._interpolate(trackpts, dist, elevations, set(i for i in samples if elevations[i] is None))
+        return success
+
     def __init__(self, api_key):
         super(GoogleElevationAPI, self).__init__()
         self.params = {
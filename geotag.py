@@ -47,7 +47,7 @@ def main(gpxs, imgs):
     for filename in gpxs:
         print('Loading %s...' % filename)
         try:
-            dom = DOM.parse(filename)
+            dom = parse_gpx(filename)
             tracks.append(GeotagQuery(TrackPoints(dom)))
         except Exception as e:
             print(str(e))
@@ -92,7 +92,7 @@ if __name__ == '__main__':
         if not os.path.isfile(x):
             print('%s is not a valid file.' % x)
             continue
-        if x.lower().endswith('gpx'):
+        if is_gpx_filename(x):
             gpx.append(x)
         else:
             img.append(x)
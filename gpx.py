@@ -4,6 +4,86 @@ from datetime import datetime
 import dateutil.parser
 from pytz import timezone
 import bisect
+import gzip
+import bz2
+from math import radians, sin, cos, atan2, sqrt, pi, isfinite
+
+EARTH_RADIUS = 6367444.7
+# length in meters of one degree of latitude
+METERS_PER_DEGREE = pi * EARTH_RADIUS / 180.
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS
+    phi1 = radians(lat1)
+    phi2 = radians(lat2)
+    delta_phi = radians(lat2 - lat1)
+    delta_lambda = radians(lon2 - lon1)
+    sin_delta_p = sin(delta_phi / 2.)
+    sin_delta_l = sin(delta_lambda / 2.)
+    a = sin_delta_p * sin_delta_p + cos(phi1) * cos(phi2) * sin_delta_l * sin_delta_l
+    c = 2. * atan2(sqrt(a), sqrt(1. - a));
+    return R * c;
+
+def positive_float(value):
+    number = float(value)
+    if not isfinite(number) or number <= 0.:
+        raise ValueError('%s is not a positive number' % value)
+    return number
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+GPX_EXTENSIONS = ['.gpx', '.gpx.gz', '.gpx.bz2']
+
+def is_gpx_filename(filename):
+    return any(filename.lower().endswith(ext) for ext in GPX_EXTENSIONS)
+
+def open_gpx(filename, mode='r'):
+    """Opens a plain, gzip or bzip2 GPX file as a stream.
+
+    When reading, the compression is detected from the magic bytes and a binary
+    stream is returned; when writing, it is chosen by extension and a text stream
+    is returned, suitable for `writexml`."""
+    if mode == 'r':
+        with open(filename, 'rb') as reader:
+            magic = reader.read(3)
+        if magic.startswith(GZIP_MAGIC):
+            return gzip.open(filename, 'rb')
+        elif magic.startswith(BZ2_MAGIC):
+            return bz2.open(filename, 'rb')
+        return open(filename, 'rb')
+    elif mode == 'w':
+        lower_filename = filename.lower()
+        if lower_filename.endswith('.gz'):
+            return gzip.open(filename, 'wt', encoding='utf-8')
+        elif lower_filename.endswith('.bz2'):
+            return bz2.open(filename, 'wt', encoding='utf-8')
+        return open(filename, 'w')
+    raise ValueError('Invalid mode: %s' % mode)
+
+def parse_gpx(filename):
+    with open_gpx(filename) as reader:
+        return DOM.parse(reader)
+
+def set_precision(dom, coord_precision=None, ele_precision=None):
+    for precision in [coord_precision, ele_precision]:
+        if precision is not None and precision < 0:
+            raise ValueError('Invalid precision: %d' % precision)
+    for tagname in ['wpt', 'rtept', 'trkpt']:
+        for point in dom.getElementsByTagName(tagname):
+            if coord_precision is not None:
+                for attr in ['lat', 'lon']:
+                    if point.hasAttribute(attr):
+                        point.setAttribute(attr, '%0.*f' % (coord_precision, float(point.getAttribute(attr))))
+            if ele_precision is not None:
+                for ele in point.getElementsByTagName('ele'):
+                    if ele.firstChild is not None and ele.firstChild.nodeType == Node.TEXT_NODE \
+                        and ele.firstChild.nodeValue.strip() != '':
+                        ele.firstChild.nodeValue = '%0.*f' % (ele_precision, float(ele.firstChild.nodeValue))
+
+def write_gpx(dom, filename, coord_precision=None, ele_precision=None):
+    set_precision(dom, coord_precision, ele_precision)
+    with open_gpx(filename, 'w') as writer:
+        dom.writexml(writer)
 
 class TrackPoint:
     def __getattr__(self, key):
@@ -1,16 +1,29 @@
 #!/usr/bin/env python3
-import xml.dom.minidom as DOM
 import sys
 import os
-from gpx import TrackPoints
-from elevation import GoogleElevationAPI as Elevation
+from gpx import TrackPoints, parse_gpx, write_gpx, positive_float
+from elevation import GoogleElevationAPI as Elevation, ElevationJournal
 import argparse
 
-def main(elevapi, filename):
-    dom = DOM.parse(filename)
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError('%s is not a non-negative integer' % value)
+    return number
+
+def main(elevapi, filename, interactive=True, coord_precision=None, ele_precision=None, spacing=None, tolerance=None):
+    dom = parse_gpx(filename)
     points = TrackPoints(dom)
-    if not elevapi.run(points):
+    journal = ElevationJournal(filename + '.journal')
+    if spacing is None:
+        success = elevapi.run(points, journal=journal)
+    else:
+        success = elevapi.run_sampled(points, spacing, tolerance, journal=journal)
+    if not success:
         print('(W) Not all elevations retrieved.')
+        if not interactive:
+            print('(W) Progress saved to %s, rerun to resume.' % journal.path)
+            return
         answer = None
         while answer is None:
             answer = input('Proceed anyway? [y/N] ').lower()
@@ -19,17 +32,30 @@ def main(elevapi, filename):
             else:
                 answer = None
         if not answer:
+            print('(W) Progress saved to %s, rerun to resume.' % journal.path)
             return
 
     os.rename(filename, filename + '.bak')
-    with open(filename, 'w') as writer:
-        dom.writexml(writer)
+    write_gpx(dom, filename, coord_precision, ele_precision)
+    journal.discard()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Add elevation information to a pre-existing GPX track.')
-    parser.add_argument('gpx', nargs='+', help='GPX file(s) to modify (a backup will be made).')
+    parser.add_argument('gpx', nargs='+', help='GPX file(s) to modify, optionally gzip or bzip2 compressed (a backup will be made).')
     parser.add_argument('-k', '--key', required=True, help='Google API key.')
+    parser.add_argument('-b', '--batch', action='store_true',
+        help='Never ask for confirmation: on failure, keep the retrieved elevations in a journal and skip the file.')
+    parser.add_argument('--coord-precision', type=non_negative_int, default=None,
+        help='Number of decimal digits to keep in latitude and longitude of waypoints, route and track points when writing.')
+    parser.add_argument('--ele-precision', type=non_negative_int, default=None,
+        help='Number of decimal digits to keep in elevations of waypoints, route and track points when writing.')
+    parser.add_argument('-s', '--spacing', type=positive_float, default=None,
+        help='Query elevation only every SPACING meters along the track and interpolate the other points.')
+    parser.add_argument('-t', '--tolerance', type=positive_float, default=None,
+        help='With --spacing, also query the points where the track deviates more than TOLERANCE meters from its simplified path.')
     args = parser.parse_args()
+    if args.tolerance is not None and args.spacing is None:
+        parser.error('--tolerance requires --spacing')
     elevapi = Elevation(args.key)
     for filename in args.gpx:
         print('Processing %s...' % filename)
@@ -37,6 +63,7 @@ if __name__ == '__main__':
             print('(E) Not a readable file.')
         else:
             try:
-                main(elevapi, filename)
+                main(elevapi, filename, not args.batch, args.coord_precision, args.ele_precision,
+                    args.spacing, args.tolerance)
             except Exception as e:
                 print(e)
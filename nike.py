@@ -2,19 +2,8 @@ from datetime import datetime, timedelta
 import dateutil.parser
 from pytz import timezone
 import re
-from math import floor, ceil, radians, sin, cos, atan2, sqrt
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6367444.7
-    phi1 = radians(lat1)
-    phi2 = radians(lat2)
-    delta_phi = radians(lat2 - lat1)
-    delta_lambda = radians(lon2 - lon1)
-    sin_delta_p = sin(delta_phi / 2.)
-    sin_delta_l = sin(delta_lambda / 2.)
-    a = sin_delta_p * sin_delta_p + cos(phi1) * cos(phi2) * sin_delta_l * sin_delta_l
-    c = 2. * atan2(sqrt(a), sqrt(1. - a));
-    return R * c;
+from math import floor, ceil
+from gpx import haversine
 
 def camel_case_to_py(txt):
     retval = ''
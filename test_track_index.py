@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import os
+import random
+import tempfile
+import unittest
+from gpx import haversine
+from track_index import TrackIndex
+
+class Point:
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+        self.elevation = None
+
+class TrackIndexTest(unittest.TestCase):
+    def _brute_force(self, points, lat, lon, k):
+        by_dist = sorted((haversine(lat, lon, pt[0], pt[1]), pt[2], pt[3]) for pt in points)
+        return [(name, idx) for dist, name, idx in by_dist[:k]]
+
+    def _check_nearest(self, index, points, queries):
+        for lat, lon, k in queries:
+            found = [(result[0], result[1]) for result in index.nearest(lat, lon, k)]
+            self.assertEqual(found, self._brute_force(points, lat, lon, k), (lat, lon, k))
+
+    def test_nearest_across_longitude(self):
+        # the closer point is one cell away in longitude, the farther one in latitude
+        index = TrackIndex(0.01)
+        for i in range(30):
+            index.add_track('filler%02d' % i, [Point(10. + i, 10.)])
+        index.add_track('lat', [Point(60.0145, 0.005)])
+        index.add_track('lon', [Point(60.005, 0.0205)])
+        self.assertEqual(index.nearest(60.005, 0.005)[0][0], 'lon')
+
+    def test_nearest_high_latitude(self):
+        rnd = random.Random(0)
+        index = TrackIndex(0.01)
+        points = []
+        for t in range(40):
+            name = 'track%02d' % t
+            lat, lon = rnd.uniform(55., 89.), rnd.uniform(-10., 10.)
+            track = []
+            for i in range(50):
+                lat = min(90., lat + rnd.gauss(0., 0.005))
+                lon += rnd.gauss(0., 0.02)
+                track.append(Point(lat, lon))
+                points.append((lat, lon, name, i))
+            index.add_track(name, track)
+        queries = [(pt[0], pt[1], 5) for pt in rnd.sample(points, 20)]
+        queries += [(rnd.uniform(55., 90.), rnd.uniform(-15., 15.), rnd.choice([1, 10])) for i in range(30)]
+        self._check_nearest(index, points, queries)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            index.save(path)
+            loaded = TrackIndex.load(path)
+            self.assertEqual(len(loaded), len(points))
+            self._check_nearest(loaded, points, queries)
+            self.assertEqual(loaded.bbox(55., -15., 90., 15.), sorted(set(pt[2] for pt in points)))
+            loaded.close()
+        finally:
+            os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import os
+import json
+import heapq
+import argparse
+from math import floor, radians, sin, cos, asin
+from gpx import TrackPoints, haversine, parse_gpx, positive_float, EARTH_RADIUS, METERS_PER_DEGREE
+
+class TrackIndex:
+    """Grid-bucketed spatial index over the points of a set of tracks.
+
+    Points are stored compactly as (lat, lon, ele, track id, point idx) in square
+    cells of `cell_size` degrees, so that queries only visit the cells around the
+    area of interest instead of scanning every track.
+    The index file holds a header with the offset of every cell, followed by one
+    line per cell; cells are read from disk only when a query first touches them."""
+
+    DEFAULT_CELL_SIZE = 0.01
+
+    def _cell(self, lat, lon):
+        return (int(floor(lat / self.cell_size)), int(floor(lon / self.cell_size)))
+
+    def _update_bounds(self, cell):
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            self._bounds[0] = min(self._bounds[0], cell[0])
+            self._bounds[1] = min(self._bounds[1], cell[1])
+            self._bounds[2] = max(self._bounds[2], cell[0])
+            self._bounds[3] = max(self._bounds[3], cell[1])
+
+    def _read_cells(self, cells):
+        # reads the cells not loaded yet in a single pass over the index file
+        pending = sorted((self._offsets[cell], cell) for cell in cells
+                         if cell in self._cells and self._cells[cell] is None)
+        for offset, cell in pending:
+            self._reader.seek(self._data_offset + offset)
+            self._cells[cell] = [tuple(entry) for entry in json.loads(self._reader.readline().decode('utf-8'))]
+
+    def _entries(self, cell):
+        if cell in self._cells and self._cells[cell] is None:
+            self._read_cells([cell])
+        return self._cells.get(cell, [])
+
+    def _insert(self, entry):
+        cell = self._cell(entry[0], entry[1])
+        if cell in self._cells:
+            self._entries(cell).append(entry)
+        else:
+            self._cells[cell] = [entry]
+            self._update_bounds(cell)
+        self._size += 1
+
+    def _ring(self, center, r):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    @staticmethod
+    def _lat_dist(lat_gap):
+        # lower bound, in meters, of the distance to any point `lat_gap` degrees of latitude away
+        return lat_gap * METERS_PER_DEGREE
+
+    @staticmethod
+    def _lon_dist(lat, lon_gap):
+        # lower bound, in meters, of the distance from a point at latitude `lat` to any point
+        # `lon_gap` degrees of longitude away, i.e. the distance to the farthest meridian
+        return EARTH_RADIUS * asin(sin(radians(min(90., lon_gap))) * cos(radians(lat)))
+
+    def _cell_min_dist(self, lat, lon, cell):
+        lat_gap = max(0., cell[0] * self.cell_size - lat, lat - (cell[0] + 1) * self.cell_size)
+        lon_gap = 360.
+        for shift in [-360., 0., 360.]:
+            lon_gap = min(lon_gap, max(0., cell[1] * self.cell_size + shift - lon,
+                                       lon - (cell[1] + 1) * self.cell_size - shift))
+        # every point of the cell is that far in latitude and in longitude
+        return max(self._lat_dist(lat_gap), self._lon_dist(lat, lon_gap))
+
+    def add_track(self, name, trackpts):
+        track_id = len(self.tracks)
+        self.tracks.append(name)
+        for idx, trackpt in enumerate(trackpts):
+            self._insert((trackpt.lat, trackpt.lon, trackpt.elevation, track_id, idx))
+        return track_id
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon):
+        min_i, min_j = self._cell(min_lat, min_lon)
+        max_i, max_j = self._cell(max_lat, max_lon)
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self._cells):
+            # the box covers more cells than there are populated ones
+            cells = [cell for cell in self._cells
+                     if min_i <= cell[0] <= max_i and min_j <= cell[1] <= max_j]
+        else:
+            cells = [(i, j) for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)]
+        self._read_cells(cells)
+        track_ids = set()
+        for cell in cells:
+            for lat, lon, ele, track_id, idx in self._entries(cell):
+                if track_id not in track_ids and min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                    track_ids.add(track_id)
+        return [self.tracks[track_id] for track_id in sorted(track_ids)]
+
+    def nearest(self, lat, lon, k=1):
+        if self._bounds is None or k < 1:
+            return []
+        heap = []
+
+        def visit(cell):
+            for entry in self._entries(cell):
+                dist = haversine(lat, lon, entry[0], entry[1])
+                item = (-dist, entry[3], entry[4], entry)
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        center = self._cell(lat, lon)
+        max_r = max(abs(center[0] - self._bounds[0]), abs(center[0] - self._bounds[2]),
+                    abs(center[1] - self._bounds[1]), abs(center[1] - self._bounds[3]))
+        # cells across the antimeridian are never farther than this in longitude
+        wrap_gap = 180. - abs(lon)
+        r = 0
+        while r <= max_r:
+            if 8 * r > len(self._cells):
+                # the ring holds more cells than there are populated ones: visit the
+                # remaining populated cells by increasing distance instead
+                remaining = [(self._cell_min_dist(lat, lon, cell), cell) for cell in self._cells
+                             if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= r]
+                remaining.sort()
+                for min_dist, cell in remaining:
+                    if len(heap) == k and min_dist > -heap[0][0]:
+                        break
+                    visit(cell)
+                break
+            for cell in self._ring(center, r):
+                if cell in self._cells:
+                    visit(cell)
+            # every point outside ring r is at least r cells away in latitude or in longitude
+            gap = r * self.cell_size
+            ring_dist = min(self._lat_dist(gap), self._lon_dist(lat, min(gap, wrap_gap)))
+            if len(heap) == k and -heap[0][0] <= ring_dist:
+                break
+            r += 1
+        results = []
+        for neg_dist, track_id, idx, entry in sorted(heap, reverse=True):
+            results.append((self.tracks[track_id], idx, entry[0], entry[1], entry[2], -neg_dist))
+        return results
+
+    def save(self, path):
+        offsets = {}
+        lines = []
+        data_size = 0
+        for cell in self._cells:
+            line = (json.dumps(self._entries(cell), separators=(',', ':')) + '\n').encode('utf-8')
+            offsets['%d,%d' % cell] = data_size
+            data_size += len(line)
+            lines.append(line)
+        header = {
+            'cell_size': self.cell_size,
+            'tracks': self.tracks,
+            'size': self._size,
+            'bounds': self._bounds,
+            'offsets': offsets
+        }
+        with open(path, 'wb') as writer:
+            writer.write((json.dumps(header, separators=(',', ':')) + '\n').encode('utf-8'))
+            for line in lines:
+                writer.write(line)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as reader:
+            header = json.loads(reader.readline().decode('utf-8'))
+            data_offset = reader.tell()
+        index = cls(header['cell_size'])
+        index.tracks = header['tracks']
+        index._size = header['size']
+        index._bounds = header['bounds']
+        index._reader = open(path, 'rb')
+        index._data_offset = data_offset
+        for key, offset in header['offsets'].items():
+            cell = tuple(int(x) for x in key.split(','))
+            index._cells[cell] = None
+            index._offsets[cell] = offset
+        return index
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def __len__(self):
+        return self._size
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        if not cell_size > 0.:
+            raise ValueError('Invalid cell size: %s' % cell_size)
+        self.cell_size = cell_size
+        self.tracks = []
+        # cell -> list of entries, or None if not yet read from `_reader`
+        self._cells = {}
+        self._offsets = {}
+        self._size = 0
+        self._bounds = None
+        self._reader = None
+        self._data_offset = 0
+
+
+def build(index_file, gpxs, cell_size):
+    index = TrackIndex(cell_size)
+    for filename in gpxs:
+        print('Loading %s...' % filename)
+        if not os.path.isfile(filename):
+            print('(E) Not a readable file.')
+            continue
+        try:
+            dom = parse_gpx(filename)
+            index.add_track(filename, TrackPoints(dom))
+        except Exception as e:
+            print(str(e))
+    index.save(index_file)
+    print('Indexed %d points from %d tracks.' % (len(index), len(index.tracks)))
+
+def query_bbox(index_file, min_lat, min_lon, max_lat, max_lon):
+    index = TrackIndex.load(index_file)
+    for name in index.bbox(min_lat, min_lon, max_lat, max_lon):
+        print(name)
+    index.close()
+
+def query_nearest(index_file, lat, lon, k):
+    index = TrackIndex.load(index_file)
+    for name, idx, pt_lat, pt_lon, pt_ele, dist in index.nearest(lat, lon, k):
+        print('%s #%d: (%f, %f, %s) at %0.1fm' % (name, idx, pt_lat, pt_lon, pt_ele, dist))
+    index.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Spatial index over a library of GPX tracks.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    build_parser = subparsers.add_parser('build', help='Index the given GPX files.')
+    build_parser.add_argument('index', help='Index file to write.')
+    build_parser.add_argument('gpx', nargs='+', help='GPX file(s) to index, optionally gzip or bzip2 compressed.')
+    build_parser.add_argument('-c', '--cell-size', type=positive_float, default=TrackIndex.DEFAULT_CELL_SIZE,
+        help='Size of a grid cell, in degrees.')
+    bbox_parser = subparsers.add_parser('bbox', help='List the tracks passing through an area.')
+    bbox_parser.add_argument('index', help='Index file to query.')
+    for coord in ['min_lat', 'min_lon', 'max_lat', 'max_lon']:
+        bbox_parser.add_argument(coord, type=float)
+    nearest_parser = subparsers.add_parser('nearest', help='Find the recorded points closest to a coordinate.')
+    nearest_parser.add_argument('index', help='Index file to query.')
+    nearest_parser.add_argument('lat', type=float)
+    nearest_parser.add_argument('lon', type=float)
+    nearest_parser.add_argument('-k', type=int, default=1, help='Number of points to return.')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.index, args.gpx, args.cell_size)
+    elif args.command == 'bbox':
+        query_bbox(args.index, args.min_lat, args.min_lon, args.max_lat, args.max_lon)
+    else:
+        query_nearest(args.index, args.lat, args.lon, args.k)